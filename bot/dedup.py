@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Tuple
+
+# Сообщение принято в обработку, ответ ещё не готов
+IN_PROGRESS = object()
+# Ответ сохранён в БД, при повторе берётся оттуда
+DONE = object()
+
+
+class RecentMessageFilter:
+    """Недавно обработанные апдейты (telegram_id, message_id) в памяти.
+
+    Хранит только отметки состояния, а не тексты ответов, поэтому занимает
+    немного памяти. Апдейты в обработке отсекаются без запроса к БД; на
+    промахе решение принимается по уникальному ключу в таблице messages.
+    """
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[int, int], object]" = OrderedDict()
+
+    def get(self, telegram_id: int, message_id: int):
+        """Вернуть IN_PROGRESS, DONE или None, если апдейт не встречался"""
+        key = (telegram_id, message_id)
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: Tuple[int, int], value: object):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def start(self, telegram_id: int, message_id: int):
+        """Отметить апдейт как принятый в обработку"""
+        self._set((telegram_id, message_id), IN_PROGRESS)
+
+    def finish(self, telegram_id: int, message_id: int):
+        """Отметить апдейт как обработанный"""
+        self._set((telegram_id, message_id), DONE)
+
+    def discard(self, telegram_id: int, message_id: int):
+        """Забыть апдейт, чтобы повторная доставка обработалась заново"""
+        self._entries.pop((telegram_id, message_id), None)
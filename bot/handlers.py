@@ -4,14 +4,25 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from database.database import AsyncSessionLocal
 from database.crud import (
-    get_or_create_user, save_message, get_conversation_context,
+    get_or_create_user, save_message, get_message, get_conversation_context,
     get_or_create_active_session, get_or_create_client_profile,
     update_client_profile, clear_user_history, finish_session
 )
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, OpenAIServiceError
+from .sender import OutboundSender, SendError
+from .dedup import RecentMessageFilter, IN_PROGRESS, DONE
 
 logger = logging.getLogger(__name__)
+
+# Сколько последних реплик передавать модели как контекст
+CONTEXT_TURNS = 20
+
 openai_service = OpenAIService()
+sender = OutboundSender()
+recent_messages = RecentMessageFilter()
+# Сохранённые, но не доставленные ответы:
+# telegram_id -> {message_id: число уже доставленных частей}
+undelivered_responses = {}
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -29,7 +40,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Новая сессия начинается автоматически при отправке сообщения."""
     
-    await update.message.reply_text(welcome_message)
+    await sender.send_text(context.bot, update.effective_chat.id, welcome_message)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -57,7 +68,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Поделитесь тем, что вас беспокоит - начнём исследование."""
     
-    await update.message.reply_text(help_message, parse_mode='Markdown')
+    await sender.send_text(context.bot, update.effective_chat.id, help_message, parse_mode='Markdown')
 
 
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -77,7 +88,7 @@ async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             message = "❌ Произошла ошибка при удалении данных. Попробуйте позже."
     
-    await update.message.reply_text(message)
+    await sender.send_text(context.bot, update.effective_chat.id, message)
 
 
 async def finish_session_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -101,75 +112,162 @@ async def finish_session_command(update: Update, context: ContextTypes.DEFAULT_T
             logger.error(f"Ошибка завершения сессии для {user_id}: {e}")
             summary_message = "❌ Произошла ошибка при завершении сессии."
     
-    await update.message.reply_text(summary_message, parse_mode='Markdown')
+    await sender.send_text(context.bot, update.effective_chat.id, summary_message, parse_mode='Markdown')
+
+
+async def deliver_response(bot, chat_id: int, telegram_id: int, message_id: int,
+                           bot_response: str) -> bool:
+    """Отправить сохранённый ответ; недоставленные части запомнить для повторной отправки"""
+    pending = undelivered_responses.get(telegram_id, {})
+    skip_chunks = pending.get(message_id, 0)
+    
+    try:
+        await sender.send_text(bot, chat_id, bot_response, skip_chunks=skip_chunks)
+    except SendError as e:
+        logger.error(f"Не удалось доставить ответ на сообщение {message_id} от {telegram_id}: {e}")
+        if e.delivered_chunks < e.total_chunks:
+            undelivered_responses.setdefault(telegram_id, {})[message_id] = e.delivered_chunks
+            return False
+        # Последняя часть упала по таймауту и, скорее всего, дошла: не дублируем
+    
+    if message_id in pending:
+        del pending[message_id]
+        if not pending:
+            del undelivered_responses[telegram_id]
+    return True
+
+
+async def replay_undelivered(db, bot, chat_id: int, telegram_id: int):
+    """Дослать части ответов, которые не удалось доставить ранее"""
+    for message_id in list(undelivered_responses.get(telegram_id, {})):
+        stored_message = await get_message(db, telegram_id, message_id)
+        if stored_message is None:
+            pending = undelivered_responses[telegram_id]
+            del pending[message_id]
+            if not pending:
+                del undelivered_responses[telegram_id]
+            continue
+        if not await deliver_response(bot, chat_id, telegram_id, message_id,
+                                      stored_message.bot_response):
+            break
+
+
+async def generate_response(db, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                            start_time: float) -> str:
+    """Получить ответ модели и сохранить сообщение, вернуть сохранённый ответ"""
+    user = update.effective_user
+    user_message = update.message.text
+    
+    # Получаем/создаем пользователя
+    db_user = await get_or_create_user(
+        db, user.id, user.username, user.first_name, user.last_name
+    )
+    
+    # Получаем активную сессию
+    session_id = await get_or_create_active_session(db, user.id)
+    
+    # Получаем профиль клиента
+    client_profile = await get_or_create_client_profile(db, user.id)
+    profile_dict = {
+        'identified_patterns': client_profile.identified_patterns,
+        'core_traumas': client_profile.core_traumas,
+        'emotional_triggers': client_profile.emotional_triggers,
+        'defense_mechanisms': client_profile.defense_mechanisms,
+        'breakthrough_moments': client_profile.breakthrough_moments,
+        'resistance_areas': client_profile.resistance_areas,
+        'therapeutic_notes': client_profile.therapeutic_notes
+    }
+    
+    # Получаем контекст беседы
+    context_messages = await get_conversation_context(db, user.id, limit=CONTEXT_TURNS)
+    
+    # Получаем ответ от OpenAI
+    async with sender.typing(context.bot, update.effective_chat.id):
+        bot_response, profile_updates = await openai_service.get_response(
+            user_message, context_messages, profile_dict
+        )
+    
+    # Обновляем профиль клиента
+    if profile_updates:
+        await update_client_profile(db, user.id, profile_updates)
+    
+    # Сохраняем сообщение
+    response_time = int((time.time() - start_time) * 1000)
+    saved_message = await save_message(
+        db, user.id, update.message.message_id,
+        user_message, bot_response, session_id, response_time
+    )
+    # При гонке с повторной доставкой отправляем уже сохранённый ответ
+    return saved_message.bot_response
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
     user = update.effective_user
-    user_message = update.message.text
+    chat_id = update.effective_chat.id
+    message_id = update.message.message_id
     start_time = time.time()
     
+    # Повторная доставка уже обработанного апдейта
+    state = recent_messages.get(user.id, message_id)
+    if state is IN_PROGRESS:
+        logger.info(f"Сообщение {message_id} от {user.id} уже обрабатывается, пропускаем")
+        return
+    if state is DONE:
+        async with AsyncSessionLocal() as db:
+            stored_message = await get_message(db, user.id, message_id)
+        if stored_message:
+            logger.info(f"Сообщение {message_id} от {user.id} уже обработано, повторяем ответ")
+            await deliver_response(context.bot, chat_id, user.id, message_id, stored_message.bot_response)
+            return
+    
+    recent_messages.start(user.id, message_id)
+    bot_response = None
+    error_text = (
+        "Произошла техническая ошибка, но наша сессия продолжается. "
+        "Я готов вас выслушать и помочь разобраться с тем, что вас тревожит."
+    )
+    
     async with AsyncSessionLocal() as db:
         try:
-            # Получаем/создаем пользователя
-            db_user = await get_or_create_user(
-                db, user.id, user.username, user.first_name, user.last_name
-            )
-            
-            # Получаем активную сессию
-            session_id = await get_or_create_active_session(db, user.id)
-            
-            # Получаем профиль клиента
-            client_profile = await get_or_create_client_profile(db, user.id)
-            profile_dict = {
-                'identified_patterns': client_profile.identified_patterns,
-                'core_traumas': client_profile.core_traumas,
-                'emotional_triggers': client_profile.emotional_triggers,
-                'defense_mechanisms': client_profile.defense_mechanisms,
-                'breakthrough_moments': client_profile.breakthrough_moments,
-                'resistance_areas': client_profile.resistance_areas,
-                'therapeutic_notes': client_profile.therapeutic_notes
-            }
-            
-            # Получаем контекст беседы
-            context_messages = await get_conversation_context(db, user.id, limit=20)
-            
-            # Получаем ответ от OpenAI
-            bot_response, profile_updates = await openai_service.get_response(
-                user_message, context_messages, profile_dict
-            )
-            
-            # Обновляем профиль клиента
-            if profile_updates:
-                await update_client_profile(db, user.id, profile_updates)
+            await replay_undelivered(db, context.bot, chat_id, user.id)
             
-            # Сохраняем сообщение
-            response_time = int((time.time() - start_time) * 1000)
-            await save_message(
-                db, user.id, update.message.message_id,
-                user_message, bot_response, session_id, response_time
-            )
+            existing_message = await get_message(db, user.id, message_id)
+            if existing_message:
+                logger.info(f"Сообщение {message_id} от {user.id} уже обработано, повторяем ответ")
+                bot_response = existing_message.bot_response
+            else:
+                bot_response = await generate_response(db, update, context, start_time)
             
-            await update.message.reply_text(bot_response)
+            recent_messages.finish(user.id, message_id)
             
         except Exception as e:
+            recent_messages.discard(user.id, message_id)
             logger.error(f"Ошибка обработки сообщения от {user.id}: {e}")
-            await update.message.reply_text(
-                "Произошла техническая ошибка, но наша сессия продолжается. "
-                "Я готов вас выслушать и помочь разобраться с тем, что вас тревожит."
-            )
+            if isinstance(e, OpenAIServiceError):
+                error_text = e.user_message
+    
+    if bot_response is None:
+        try:
+            await sender.send_text(context.bot, chat_id, error_text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение об ошибке: {e}")
+        return
+    
+    # Ответ уже сохранён: ошибка отправки не должна превращаться в сообщение об ошибке
+    await deliver_response(context.bot, chat_id, user.id, message_id, bot_response)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка в боте: {context.error}")
     
-    if update and update.effective_message:
+    if update and update.effective_chat:
         try:
-            await update.effective_message.reply_text(
+            await sender.send_text(
+                context.bot, update.effective_chat.id,
                 "⚠️ Произошла техническая ошибка. Я уже работаю над её устранением. "
                 "Попробуйте повторить запрос через несколько минут."
             )
         except Exception as e:
-            logger.error(f"Не удалось отправить сообщение об ошибке: {e}"))
\ No newline at end of file
+            logger.error(f"Не удалось отправить сообщение об ошибке: {e}")
\ No newline at end of file
@@ -0,0 +1,251 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import List
+from telegram import Bot, Message
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter, TimedOut, NetworkError
+
+logger = logging.getLogger(__name__)
+
+# Индикатор набора текста в Telegram гаснет через ~5 секунд
+TYPING_INTERVAL = 4.5
+
+# Telegram не сообщает, чей лимит превышен: длинный retry_after обычно означает
+# лимит конкретного чата (например, группы), поэтому глобально тормозим недолго
+GLOBAL_PAUSE_CAP = 1.0
+
+
+def utf16_len(text: str) -> int:
+    """Длина текста так, как её считает Telegram (в кодовых единицах UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _utf16_prefix(text: str, limit: int) -> int:
+    """Индекс, до которого префикс text укладывается в limit единиц UTF-16"""
+    units = 0
+    for i, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return i
+    return len(text)
+
+
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH,
+                  paragraphs_only: bool = False) -> List[str]:
+    """Разбить длинный текст на части не длиннее limit единиц UTF-16.
+
+    Режем по абзацам, затем по строкам, затем по пробелам и только в крайнем
+    случае посреди слова. С paragraphs_only режем только между абзацами
+    (для разметки, чтобы не разорвать сущность), а если абзац не помещается
+    целиком, бросаем ValueError.
+    """
+    separators = ('\n\n',) if paragraphs_only else ('\n\n', '\n', ' ')
+    text = text.strip()
+    chunks = []
+    while utf16_len(text) > limit:
+        window = text[:_utf16_prefix(text, limit)]
+        cut = -1
+        for separator in separators:
+            cut = window.rfind(separator)
+            if cut > 0:
+                break
+        if cut <= 0:
+            if paragraphs_only:
+                raise ValueError("Абзац длиннее лимита сообщения")
+            cut = len(window)
+
+        chunk = text[:cut].rstrip()
+        # Пустые части Telegram отклоняет
+        if chunk:
+            chunks.append(chunk)
+        text = text[cut:].lstrip()
+
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class SendError(Exception):
+    """Не удалось отправить все части сообщения"""
+
+    def __init__(self, sent_chunks: int, total_chunks: int, error: Exception):
+        super().__init__(f"отправлено {sent_chunks} из {total_chunks} частей: {error}")
+        self.sent_chunks = sent_chunks
+        self.total_chunks = total_chunks
+        self.error = error
+
+    @property
+    def delivered_chunks(self) -> int:
+        """Сколько частей считать доставленными: часть с таймаутом скорее всего дошла"""
+        if isinstance(self.error, TimedOut):
+            return self.sent_chunks + 1
+        return self.sent_chunks
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (после 429 от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundSender:
+    """Отправка сообщений с учётом лимитов Telegram.
+
+    Глобальный лимит ~30 сообщений в секунду на бота и ~1 в секунду на чат
+    (с небольшим запасом на всплеск, чтобы части длинного ответа уходили сразу).
+    """
+
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1,
+                 per_chat_burst: float = 3, max_retries: int = 3,
+                 max_chat_buckets: int = 10000, retry_timeouts: bool = False):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        # Запрос с таймаутом часто уже доставлен, повтор может продублировать ответ
+        self.retry_timeouts = retry_timeouts
+        self._chat_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._typing_sent_at = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+            self._evict_idle_buckets()
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle_buckets(self):
+        """Удалить давно неиспользуемые полные ведра"""
+        while len(self._chat_buckets) > self.max_chat_buckets:
+            chat_id, bucket = next(iter(self._chat_buckets.items()))
+            if not bucket.is_idle():
+                break
+            del self._chat_buckets[chat_id]
+            self._typing_sent_at.pop(chat_id, None)
+
+    async def _call(self, chat_id: int, method, *args, **kwargs):
+        """Вызвать метод Bot API с учётом лимитов и повторами"""
+        bucket = self._chat_bucket(chat_id)
+
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"Flood limit для чата {chat_id}, повтор через {retry_after} с")
+                # Ждёт только этот чат; остальные притормаживаем не дольше GLOBAL_PAUSE_CAP
+                bucket.pause(retry_after)
+                self.global_bucket.pause(min(retry_after, GLOBAL_PAUSE_CAP))
+                if attempt == self.max_retries:
+                    raise
+            except BadRequest:
+                # BadRequest наследуется от NetworkError, но повтор не поможет
+                raise
+            except TimedOut:
+                if not self.retry_timeouts or attempt == self.max_retries:
+                    raise
+                logger.warning(f"Таймаут при отправке в чат {chat_id}, повторяем")
+            except NetworkError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"Ошибка сети при отправке в чат {chat_id}: {e}, повтор через {delay} с")
+                await asyncio.sleep(delay)
+
+    async def send_text(self, bot: Bot, chat_id: int, text: str, skip_chunks: int = 0,
+                        **kwargs) -> List[Message]:
+        """Отправить текст, при необходимости разбив его на несколько сообщений.
+
+        skip_chunks пропускает уже доставленные части при повторной отправке.
+        При ошибке бросает SendError с числом отправленных частей.
+        """
+        if kwargs.get('parse_mode'):
+            try:
+                chunks = split_message(text, paragraphs_only=True)
+            except ValueError:
+                logger.warning(f"Текст для чата {chat_id} не делится по абзацам, отправляем без разметки")
+                kwargs.pop('parse_mode')
+                chunks = split_message(text)
+        else:
+            chunks = split_message(text)
+
+        sent = []
+        for index in range(skip_chunks, len(chunks)):
+            try:
+                sent.append(await self._call(chat_id, bot.send_message, chat_id, chunks[index], **kwargs))
+            except Exception as e:
+                raise SendError(index, len(chunks), e) from e
+        # Отправленное сообщение гасит индикатор набора
+        self._typing_sent_at.pop(chat_id, None)
+        return sent
+
+    async def send_typing(self, bot: Bot, chat_id: int):
+        """Показать индикатор набора, не чаще раза в TYPING_INTERVAL на чат"""
+        now = time.monotonic()
+        if now - self._typing_sent_at.get(chat_id, 0.0) < TYPING_INTERVAL:
+            return
+        self._typing_sent_at[chat_id] = now
+        try:
+            # Индикатор не расходует лимит чата, только глобальный
+            await self.global_bucket.acquire()
+            await bot.send_chat_action(chat_id, ChatAction.TYPING)
+        except Exception as e:
+            logger.debug(f"Не удалось отправить индикатор набора в чат {chat_id}: {e}")
+
+    @asynccontextmanager
+    async def typing(self, bot: Bot, chat_id: int):
+        """Поддерживать индикатор набора, пока выполняется блок"""
+        async def keep_typing():
+            while True:
+                await self.send_typing(bot, chat_id)
+                await asyncio.sleep(TYPING_INTERVAL)
+
+        task = asyncio.create_task(keep_typing())
+        try:
+            yield
+        finally:
+            task.cancel()
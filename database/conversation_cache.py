@@ -0,0 +1,155 @@
+import os
+import sys
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+# Накладные расходы на объект Turn и ячейку deque (оценка)
+TURN_OVERHEAD = sys.getsizeof(object()) + 2 * 8 + 8
+
+
+class Turn:
+    """Одна реплика пользователя и ответ бота"""
+    __slots__ = ('user_message', 'bot_response')
+
+    def __init__(self, user_message: str, bot_response: str):
+        self.user_message = user_message
+        self.bot_response = bot_response
+
+    def size(self) -> int:
+        return sys.getsizeof(self.user_message) + sys.getsizeof(self.bot_response) + TURN_OVERHEAD
+
+
+class _UserBuffer:
+    __slots__ = ('turns', 'bytes')
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.bytes = 0
+
+    def append(self, turn: Turn) -> int:
+        """Добавить реплику, вернуть изменение занимаемой памяти"""
+        delta = turn.size()
+        if len(self.turns) == self.turns.maxlen:
+            delta -= self.turns[0].size()
+        self.turns.append(turn)
+        self.bytes += delta
+        return delta
+
+
+class ConversationCache:
+    """Кольцевые буферы последних реплик пользователей в памяти процесса.
+
+    Буфер создаётся только при загрузке истории из БД, поэтому всегда содержит
+    полный хвост диалога. Пользователи вытесняются по LRU при превышении
+    бюджета памяти. Кэш локален для процесса: при нескольких инстансах бота
+    с одной БД его нужно отключить (CONVERSATION_CACHE_MAX_BYTES=0).
+
+    max_turns должен быть не меньше истории, которую запрашивает обработчик,
+    иначе запросы обходят буфер (считаются в misses и oversized).
+    """
+
+    def __init__(self, max_turns: int = 20, max_bytes: int = 64 * 1024 * 1024):
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self._buffers: "OrderedDict[int, _UserBuffer]" = OrderedDict()
+        # Пользователи, чья история сейчас читается из БД: True, если за время
+        # чтения были записи и загруженный снимок устарел
+        self._loading: Dict[int, bool] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.oversized = 0
+        self.evictions = 0
+
+    def get(self, telegram_id: int, limit: int) -> Optional[List[Dict]]:
+        """Вернуть контекст в формате OpenAI или None, если нужен запрос к БД"""
+        if limit > self.max_turns:
+            # Буфер меньше запрошенной истории: такие запросы всегда идут в БД
+            self.misses += 1
+            self.oversized += 1
+            return None
+
+        buffer = self._buffers.get(telegram_id)
+        if buffer is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._buffers.move_to_end(telegram_id)
+
+        turns = list(buffer.turns)[-limit:] if limit else []
+        context = []
+        for turn in turns:
+            context.extend([
+                {"role": "user", "content": turn.user_message},
+                {"role": "assistant", "content": turn.bot_response}
+            ])
+        return context
+
+    def begin_load(self, telegram_id: int):
+        """Отметить начало чтения истории из БД"""
+        self._loading[telegram_id] = False
+
+    def finish_load(self, telegram_id: int, turns: List[Turn]):
+        """Сохранить прочитанную из БД историю (в хронологическом порядке)"""
+        stale = self._loading.pop(telegram_id, True)
+        if stale or self.max_bytes <= 0:
+            return
+
+        self._drop(telegram_id)
+        buffer = _UserBuffer(self.max_turns)
+        for turn in turns[-self.max_turns:]:
+            buffer.append(turn)
+
+        self._buffers[telegram_id] = buffer
+        self.total_bytes += buffer.bytes
+        self._evict()
+
+    def append(self, telegram_id: int, user_message: str, bot_response: str):
+        """Добавить новую реплику, если история пользователя уже в памяти"""
+        if telegram_id in self._loading:
+            self._loading[telegram_id] = True
+
+        buffer = self._buffers.get(telegram_id)
+        if buffer is None:
+            return
+
+        self.total_bytes += buffer.append(Turn(user_message, bot_response))
+        self._buffers.move_to_end(telegram_id)
+        self._evict()
+
+    def invalidate(self, telegram_id: int):
+        """Сбросить историю пользователя (перечитается из БД)"""
+        if telegram_id in self._loading:
+            self._loading[telegram_id] = True
+        self._drop(telegram_id)
+
+    def _drop(self, telegram_id: int):
+        buffer = self._buffers.pop(telegram_id, None)
+        if buffer is not None:
+            self.total_bytes -= buffer.bytes
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._buffers:
+            _, buffer = self._buffers.popitem(last=False)
+            self.total_bytes -= buffer.bytes
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Статистика использования памяти и попаданий"""
+        return {
+            'users': len(self._buffers),
+            'turns': sum(len(buffer.turns) for buffer in self._buffers.values()),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'oversized': self.oversized,
+            'evictions': self.evictions,
+        }
+
+
+conversation_cache = ConversationCache(
+    max_turns=int(os.getenv("CONVERSATION_CACHE_MAX_TURNS", "20")),
+    max_bytes=int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
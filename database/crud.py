@@ -1,10 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import desc, func, and_
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 import uuid
 from .models import User, Message, ClientProfile, TherapySession
+from .conversation_cache import conversation_cache, Turn
 
 
 async def get_or_create_user(db: AsyncSession, telegram_id: int, username: str = None, 
@@ -91,10 +93,27 @@ async def get_or_create_active_session(db: AsyncSession, telegram_id: int) -> st
         return new_session_id
 
 
+async def get_message(db: AsyncSession, telegram_id: int, message_id: int) -> Optional[Message]:
+    """Найти уже обработанное сообщение по идентификатору Telegram"""
+    result = await db.execute(
+        select(Message).where(
+            and_(
+                Message.telegram_id == telegram_id,
+                Message.message_id == message_id
+            )
+        )
+    )
+    return result.scalar_one_or_none()
+
+
 async def save_message(db: AsyncSession, telegram_id: int, message_id: int,
                       user_message: str, bot_response: str, session_id: str,
                       response_time_ms: int = None) -> Message:
-    """Сохранить сообщение в базу данных"""
+    """Сохранить сообщение в базу данных.
+
+    Если сообщение с таким message_id уже сохранено (повторная доставка),
+    возвращается существующая запись, счётчик сессии не увеличивается.
+    """
     message = Message(
         telegram_id=telegram_id,
         message_id=message_id,
@@ -103,36 +122,60 @@ async def save_message(db: AsyncSession, telegram_id: int, message_id: int,
         session_id=session_id,
         response_time_ms=response_time_ms
     )
-    db.add(message)
     
-    # Обновляем счетчик сообщений в сессии
-    result = await db.execute(
-        select(TherapySession).where(TherapySession.session_id == session_id)
-    )
-    session = result.scalar_one_or_none()
-    if session:
-        session.messages_count += 1
+    try:
+        db.add(message)
+        
+        # Обновляем счетчик сообщений в сессии
+        result = await db.execute(
+            select(TherapySession).where(TherapySession.session_id == session_id)
+        )
+        session = result.scalar_one_or_none()
+        if session:
+            session.messages_count += 1
+        
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        existing = await get_message(db, telegram_id, message_id)
+        if existing is None:
+            raise
+        return existing
+    
+    conversation_cache.append(telegram_id, user_message, bot_response)
     
-    await db.commit()
     await db.refresh(message)
     return message
 
 
 async def get_conversation_context(db: AsyncSession, telegram_id: int, limit: int = 100) -> List[Dict]:
     """Получить контекст последних сообщений для AI"""
+    context = conversation_cache.get(telegram_id, limit)
+    if context is not None:
+        return context
+    
+    # Историю в пределах буфера читаем целиком, чтобы закэшировать её
+    cacheable = limit <= conversation_cache.max_turns
+    if cacheable:
+        conversation_cache.begin_load(telegram_id)
+    
     result = await db.execute(
-        select(Message)
+        select(Message.user_message, Message.bot_response)
         .where(Message.telegram_id == telegram_id)
         .order_by(desc(Message.created_at))
-        .limit(limit)
+        .limit(conversation_cache.max_turns if cacheable else limit)
     )
-    messages = result.scalars().all()
+    turns = [Turn(row.user_message, row.bot_response) for row in reversed(result.all())]
+    
+    if cacheable:
+        conversation_cache.finish_load(telegram_id, turns)
+        turns = turns[-limit:] if limit else []
     
     context = []
-    for msg in reversed(messages):
+    for turn in turns:
         context.extend([
-            {"role": "user", "content": msg.user_message},
-            {"role": "assistant", "content": msg.bot_response}
+            {"role": "user", "content": turn.user_message},
+            {"role": "assistant", "content": turn.bot_response}
         ])
     
     return context
@@ -241,6 +284,7 @@ async def clear_user_history(db: AsyncSession, telegram_id: int) -> bool:
             await db.delete(profile)
         
         await db.commit()
+        conversation_cache.invalidate(telegram_id)
         return True
     except Exception:
         await db.rollback()
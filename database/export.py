@@ -0,0 +1,119 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func, and_, cast, Date
+from typing import AsyncIterator, Dict, List, Optional
+from datetime import datetime, timedelta
+from .models import Message, ClientProfile, TherapySession
+
+# Сколько строк забирать с серверного курсора за раз
+DEFAULT_BATCH_SIZE = 1000
+
+EXPORT_MODELS = {
+    'messages': (Message, Message.created_at),
+    'sessions': (TherapySession, TherapySession.started_at),
+    'profiles': (ClientProfile, ClientProfile.created_at),
+}
+
+
+def split_date_range(date_from: datetime, date_to: datetime, days: int) -> List[tuple]:
+    """Разбить интервал дат на отрезки по days дней"""
+    ranges = []
+    start = date_from
+    while start < date_to:
+        end = min(start + timedelta(days=days), date_to)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _date_filter(column, date_from: Optional[datetime], date_to: Optional[datetime]):
+    conditions = []
+    if date_from:
+        conditions.append(column >= date_from)
+    if date_to:
+        conditions.append(column < date_to)
+    return and_(*conditions) if conditions else None
+
+
+def _row_to_dict(obj) -> Dict:
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+
+async def stream_rows(db: AsyncSession, table: str, date_from: datetime = None,
+                      date_to: datetime = None,
+                      batch_size: int = DEFAULT_BATCH_SIZE) -> AsyncIterator[List[Dict]]:
+    """Потоково выгрузить строки таблицы пачками через серверный курсор"""
+    model, date_column = EXPORT_MODELS[table]
+
+    query = select(model).order_by(model.id)
+    condition = _date_filter(date_column, date_from, date_to)
+    if condition is not None:
+        query = query.where(condition)
+
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for partition in result.scalars().partitions(batch_size):
+        yield [_row_to_dict(obj) for obj in partition]
+        # Не держим выгруженные объекты в identity map
+        db.expunge_all()
+
+
+async def response_time_percentiles(db: AsyncSession, date_from: datetime = None,
+                                    date_to: datetime = None,
+                                    percentiles=(0.5, 0.9, 0.95, 0.99)) -> Dict[str, Optional[float]]:
+    """Перцентили времени ответа (считаются на стороне PostgreSQL)"""
+    columns = [
+        func.percentile_cont(p).within_group(Message.response_time_ms).label(f"p{int(p * 100)}")
+        for p in percentiles
+    ]
+    query = select(*columns).where(Message.response_time_ms.isnot(None))
+    condition = _date_filter(Message.created_at, date_from, date_to)
+    if condition is not None:
+        query = query.where(condition)
+
+    result = await db.execute(query)
+    return dict(result.one()._mapping)
+
+
+async def messages_per_session(db: AsyncSession, date_from: datetime = None,
+                               date_to: datetime = None) -> Dict[str, float]:
+    """Статистика количества сообщений на сессию"""
+    per_session = select(
+        Message.session_id, func.count(Message.id).label('cnt')
+    ).group_by(Message.session_id)
+    condition = _date_filter(Message.created_at, date_from, date_to)
+    if condition is not None:
+        per_session = per_session.where(condition)
+    per_session = per_session.subquery()
+
+    result = await db.execute(
+        select(
+            func.count().label('sessions'),
+            func.avg(per_session.c.cnt).label('avg'),
+            func.percentile_cont(0.5).within_group(per_session.c.cnt).label('median'),
+            func.max(per_session.c.cnt).label('max'),
+        )
+    )
+    row = result.one()
+    return {
+        'sessions': row.sessions,
+        'avg': float(row.avg) if row.avg is not None else None,
+        'median': row.median,
+        'max': row.max,
+    }
+
+
+async def active_users_per_day(db: AsyncSession, date_from: datetime = None,
+                               date_to: datetime = None) -> Dict[str, int]:
+    """Количество активных пользователей по дням"""
+    day = cast(Message.created_at, Date)
+    query = (
+        select(day.label('day'), func.count(func.distinct(Message.telegram_id)).label('users'))
+        .group_by(day)
+        .order_by(day)
+    )
+    condition = _date_filter(Message.created_at, date_from, date_to)
+    if condition is not None:
+        query = query.where(condition)
+
+    result = await db.execute(query)
+    return {row.day.isoformat(): row.users for row in result}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, BigInteger, Boolean, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 
@@ -19,6 +19,10 @@ class User(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Повторно доставленный апдейт не должен создавать дубликат
+        UniqueConstraint("telegram_id", "message_id", name="uq_messages_telegram_message"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(BigInteger, index=True, nullable=False)
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, Boolean, DateTime, Integer
+from database.database import AsyncSessionLocal
+from database.export import (
+    EXPORT_MODELS, stream_rows, split_date_range,
+    response_time_percentiles, messages_per_session, active_users_per_day
+)
+
+load_dotenv()
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'INFO'))
+)
+logger = logging.getLogger(__name__)
+
+# Строк в одной row group Parquet-файла
+PARQUET_ROW_GROUP_SIZE = 65536
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Не удалось сериализовать {type(value)}")
+
+
+class JsonlWriter:
+    def __init__(self, path: str, table: str):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(row, ensure_ascii=False, default=_json_default))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str, table: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для выгрузки в Parquet установите pyarrow")
+
+        self.pa = pa
+        self.schema = self._build_schema(pa, EXPORT_MODELS[table][0])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.buffer = []
+
+    @staticmethod
+    def _build_schema(pa, model):
+        """Явная схема по модели, чтобы пачки с пустыми колонками совпадали по типам"""
+        fields = []
+        for column in model.__table__.columns:
+            if isinstance(column.type, (Integer, BigInteger)):
+                arrow_type = pa.int64()
+            elif isinstance(column.type, Boolean):
+                arrow_type = pa.bool_()
+            elif isinstance(column.type, DateTime):
+                arrow_type = pa.timestamp('us', tz='UTC')
+            else:
+                arrow_type = pa.string()
+            fields.append(pa.field(column.name, arrow_type))
+        return pa.schema(fields)
+
+    def write(self, rows):
+        # Копим строки до размера row group, иначе каждая пачка курсора
+        # становится отдельной крошечной группой
+        self.buffer.extend(rows)
+        if len(self.buffer) >= PARQUET_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer, schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        try:
+            self._flush()
+        finally:
+            self.writer.close()
+
+
+WRITERS = {'jsonl': (JsonlWriter, 'jsonl'), 'parquet': (ParquetWriter, 'parquet')}
+
+
+async def export_part(table: str, fmt: str, path: str, date_from=None, date_to=None,
+                      batch_size: int = 1000) -> int:
+    """Выгрузить одну часть таблицы в файл"""
+    writer_class, _ = WRITERS[fmt]
+    writer = writer_class(path, table)
+    total = 0
+    try:
+        async with AsyncSessionLocal() as db:
+            async for rows in stream_rows(db, table, date_from, date_to, batch_size):
+                writer.write(rows)
+                total += len(rows)
+    finally:
+        writer.close()
+
+    logger.info(f"{path}: выгружено {total} строк")
+    return total
+
+
+async def gather_limited(workers: int, coros):
+    """Выполнить корутины параллельно, не более workers одновременно"""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def limited(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[limited(coro) for coro in coros])
+
+
+async def run_export(args):
+    os.makedirs(args.out, exist_ok=True)
+    _, ext = WRITERS[args.format]
+
+    tasks = []
+    for table in args.tables:
+        if args.date_from and args.date_to and args.chunk_days:
+            for start, end in split_date_range(args.date_from, args.date_to, args.chunk_days):
+                path = os.path.join(args.out, f"{table}_{start:%Y%m%d}_{end:%Y%m%d}.{ext}")
+                tasks.append(export_part(
+                    table, args.format, path, start, end, args.batch_size
+                ))
+        else:
+            path = os.path.join(args.out, f"{table}.{ext}")
+            tasks.append(export_part(
+                table, args.format, path, args.date_from, args.date_to, args.batch_size
+            ))
+
+    totals = await gather_limited(args.workers, tasks)
+    logger.info(f"Выгрузка завершена, всего строк: {sum(totals)}")
+
+
+async def run_report(args):
+    async def in_session(func, *func_args):
+        async with AsyncSessionLocal() as db:
+            return await func(db, *func_args)
+
+    # Активные пользователи по дням независимы для непересекающихся интервалов
+    if args.date_from and args.date_to and args.chunk_days:
+        ranges = split_date_range(args.date_from, args.date_to, args.chunk_days)
+    else:
+        ranges = [(args.date_from, args.date_to)]
+
+    percentiles, per_session, *daily_parts = await gather_limited(args.workers, [
+        in_session(response_time_percentiles, args.date_from, args.date_to),
+        in_session(messages_per_session, args.date_from, args.date_to),
+        *[in_session(active_users_per_day, start, end) for start, end in ranges]
+    ])
+
+    active_users = {}
+    for part in daily_parts:
+        active_users.update(part)
+
+    report = {
+        'response_time_ms': percentiles,
+        'messages_per_session': per_session,
+        'active_users_per_day': active_users,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Выгрузка и аналитика диалогов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--from', dest='date_from', type=parse_date, help="Начало интервала (YYYY-MM-DD)")
+    common.add_argument('--to', dest='date_to', type=parse_date, help="Конец интервала, не включительно")
+    common.add_argument('--chunk-days', type=int, default=0, help="Разбить интервал на части по N дней")
+    common.add_argument('--workers', type=int, default=1, help="Параллельных запросов к БД")
+
+    export_parser = subparsers.add_parser('export', parents=[common], help="Потоковая выгрузка таблиц")
+    export_parser.add_argument('--tables', nargs='+', choices=list(EXPORT_MODELS), default=list(EXPORT_MODELS))
+    export_parser.add_argument('--format', choices=list(WRITERS), default='jsonl')
+    export_parser.add_argument('--out', default='exports')
+    export_parser.add_argument('--batch-size', type=int, default=1000)
+
+    subparsers.add_parser('report', parents=[common], help="Агрегированный отчёт")
+    return parser
+
+
+async def main():
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.chunk_days and not (args.date_from and args.date_to):
+        parser.error("--chunk-days требует указать и --from, и --to")
+
+    if args.command == 'export':
+        await run_export(args)
+    else:
+        await run_report(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
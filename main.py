@@ -5,9 +5,11 @@ import signal
 from dotenv import load_dotenv
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from database.database import init_db
+from database.conversation_cache import conversation_cache
 from bot.handlers import (
     start_command, help_command, clear_command, 
-    finish_session_command, handle_message, error_handler
+    finish_session_command, handle_message, error_handler, openai_service,
+    CONTEXT_TURNS
 )
 
 load_dotenv()
@@ -18,6 +20,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+STATS_LOG_INTERVAL = int(os.getenv("STATS_LOG_INTERVAL", "600"))
+
+
+def log_stats():
+    """Записать в лог статистику кэшей"""
+    logger.info(f"Кэш промпта OpenAI: {openai_service.cache_stats()}")
+    logger.info(f"Буфер диалогов: {conversation_cache.stats()}")
+
+
+async def log_stats_periodically():
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        log_stats()
+
 
 async def main():
     """Основная функция приложения"""
@@ -32,6 +48,13 @@ async def main():
         logger.error("OPENAI_API_KEY не установлен!")
         return
     
+    if conversation_cache.max_bytes > 0 and conversation_cache.max_turns < CONTEXT_TURNS:
+        logger.error(
+            f"CONVERSATION_CACHE_MAX_TURNS={conversation_cache.max_turns} меньше истории "
+            f"диалога ({CONTEXT_TURNS}): буфер не будет использоваться"
+        )
+        return
+    
     logger.info("Инициализация базы данных...")
     try:
         await init_db()
@@ -41,7 +64,14 @@ async def main():
         return
     
     logger.info("Создание Telegram бота...")
-    application = Application.builder().token(telegram_token).build()
+    builder = Application.builder().token(telegram_token)
+    
+    # Альтернативный адрес Bot API (локальный сервер или заглушка для тестов)
+    api_base_url = os.getenv("TELEGRAM_API_BASE_URL")
+    if api_base_url:
+        builder = builder.base_url(api_base_url)
+    
+    application = builder.build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
@@ -60,6 +90,8 @@ async def main():
     
     logger.info("Бот запущен и готов к работе!")
     
+    stats_task = asyncio.create_task(log_stats_periodically())
+    
     try:
         await application.start()
         await application.updater.start_polling(
@@ -82,9 +114,11 @@ async def main():
         logger.error(f"Ошибка в работе бота: {e}")
     finally:
         logger.info("Остановка бота...")
+        stats_task.cancel()
         await application.updater.stop()
         await application.stop()
         await application.shutdown()
+        log_stats()
 
 
 if __name__ == "__main__":
@@ -3,9 +3,19 @@ import os
 import json
 from typing import List, Dict, Optional
 import logging
+from .prompt_builder import PromptBuilder
 
 logger = logging.getLogger(__name__)
 
+
+class OpenAIServiceError(Exception):
+    """Не удалось получить ответ модели; user_message можно показать клиенту"""
+
+    def __init__(self, user_message: str):
+        super().__init__(user_message)
+        self.user_message = user_message
+
+
 class OpenAIService:
     def __init__(self):
         self.client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -50,24 +60,22 @@ class OpenAIService:
 }
 
 Начинай работу с выяснения конкретного саморазрушающего поведения и первого вопроса к источнику эмоционального голода."""
+        self.prompt_builder = PromptBuilder(self.system_prompt)
+        
+        # Статистика кэширования промпта на стороне OpenAI
+        self.prompt_tokens_total = 0
+        self.cached_tokens_total = 0
 
     async def get_response(self, user_message: str, conversation_context: List[Dict] = None, 
                           client_profile: Dict = None) -> tuple[str, Dict]:
-        """Получить ответ от OpenAI GPT и обновления профиля"""
+        """Получить ответ от OpenAI GPT и обновления профиля.
+
+        При ошибке бросает OpenAIServiceError, ничего не возвращая вместо ответа.
+        """
         try:
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            # Добавляем профиль клиента в контекст
-            if client_profile:
-                profile_context = self._format_profile_context(client_profile)
-                if profile_context:
-                    messages.append({"role": "system", "content": profile_context})
-            
-            # Добавляем историю сообщений (последние 30 для контекста)
-            if conversation_context:
-                messages.extend(conversation_context[-30:])
-            
-            messages.append({"role": "user", "content": user_message})
+            messages = self.prompt_builder.build(
+                user_message, conversation_context, client_profile
+            )
             
             response = await self.client.chat.completions.create(
                 model=self.model,
@@ -79,6 +87,8 @@ class OpenAIService:
                 presence_penalty=0.1
             )
             
+            self._record_usage(response.usage)
+            
             full_response = response.choices[0].message.content
             
             # Извлекаем JSON с обновлениями профиля
@@ -87,30 +97,52 @@ class OpenAIService:
             return response_text, profile_updates
             
         except openai.APIError as e:
+            # Ошибку не выдаём за ответ: иначе её сохранят и будут повторять вместо ответа модели
             logger.error(f"OpenAI API error: {e}")
-            return ("Сейчас возникли технические сложности. Однако это не останавливает нашу работу. "
-                   "Можете поделиться тем, что вас беспокоит, а я выслушаю как только система восстановится."), {}
+            raise OpenAIServiceError(
+                "Сейчас возникли технические сложности. Однако это не останавливает нашу работу. "
+                "Можете поделиться тем, что вас беспокоит, а я выслушаю как только система восстановится."
+            ) from e
         except Exception as e:
             logger.error(f"Unexpected error in OpenAI service: {e}")
-            return ("Произошла техническая ошибка, но наша сессия продолжается. "
-                   "Я готов вас выслушать и помочь разобраться с тем, что вас тревожит."), {}
+            raise OpenAIServiceError(
+                "Произошла техническая ошибка, но наша сессия продолжается. "
+                "Я готов вас выслушать и помочь разобраться с тем, что вас тревожит."
+            ) from e
 
-    def _format_profile_context(self, profile: Dict) -> str:
-        """Форматировать профиль клиента для контекста"""
-        context_parts = ["ПРОФИЛЬ КЛИЕНТА:"]
+    def _record_usage(self, usage) -> None:
+        """Учесть закэшированные токены промпта из поля usage"""
+        if not usage:
+            return
         
-        if profile.get('identified_patterns'):
-            context_parts.append(f"Выявленные паттерны: {profile['identified_patterns']}")
-        if profile.get('core_traumas'):
-            context_parts.append(f"Основные травмы: {profile['core_traumas']}")
-        if profile.get('emotional_triggers'):
-            context_parts.append(f"Эмоциональные триггеры: {profile['emotional_triggers']}")
-        if profile.get('defense_mechanisms'):
-            context_parts.append(f"Защитные механизмы: {profile['defense_mechanisms']}")
-        if profile.get('therapeutic_notes'):
-            context_parts.append(f"Терапевтические заметки: {profile['therapeutic_notes']}")
-            
-        return "\n".join(context_parts) if len(context_parts) > 1 else ""
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        details = getattr(usage, 'prompt_tokens_details', None)
+        # В openai==1.3.0 у CompletionUsage нет этого поля, и SDK отдаёт его как dict
+        if isinstance(details, dict):
+            cached_tokens = details.get('cached_tokens') or 0
+        else:
+            cached_tokens = getattr(details, 'cached_tokens', 0) or 0
+        
+        self.prompt_tokens_total += prompt_tokens
+        self.cached_tokens_total += cached_tokens
+        
+        if prompt_tokens:
+            logger.debug(
+                f"Prompt cache: {cached_tokens}/{prompt_tokens} токенов "
+                f"({cached_tokens / prompt_tokens:.0%}), "
+                f"всего {self.cache_ratio():.0%}"
+            )
+
+    def cache_ratio(self) -> float:
+        """Доля закэшированных токенов промпта за время работы"""
+        if not self.prompt_tokens_total:
+            return 0.0
+        return self.cached_tokens_total / self.prompt_tokens_total
+
+    def cache_stats(self) -> str:
+        """Сводка по кэшированию промпта для логов"""
+        return (f"{self.cached_tokens_total}/{self.prompt_tokens_total} токенов промпта "
+                f"из кэша ({self.cache_ratio():.0%})")
 
     def _extract_profile_updates(self, response: str) -> tuple[str, Dict]:
         """Извлечь обновления профиля из ответа"""
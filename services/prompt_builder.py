@@ -0,0 +1,58 @@
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple
+
+# Порядок полей профиля фиксирован, чтобы текст блока был байт-в-байт стабильным
+PROFILE_FIELDS = (
+    ('identified_patterns', 'Выявленные паттерны'),
+    ('core_traumas', 'Основные травмы'),
+    ('emotional_triggers', 'Эмоциональные триггеры'),
+    ('defense_mechanisms', 'Защитные механизмы'),
+    ('therapeutic_notes', 'Терапевтические заметки'),
+)
+
+
+@lru_cache(maxsize=1024)
+def _render_profile(values: Tuple[Optional[str], ...]) -> str:
+    """Отрендерить блок профиля (кэшируется до изменения профиля)"""
+    context_parts = ["ПРОФИЛЬ КЛИЕНТА:"]
+
+    for (_, title), value in zip(PROFILE_FIELDS, values):
+        if value:
+            context_parts.append(f"{title}: {value}")
+
+    return "\n".join(context_parts) if len(context_parts) > 1 else ""
+
+
+def format_profile_context(profile: Optional[Dict]) -> str:
+    """Форматировать профиль клиента для контекста"""
+    if not profile:
+        return ""
+    return _render_profile(tuple(profile.get(field) for field, _ in PROFILE_FIELDS))
+
+
+class PromptBuilder:
+    """Сборка сообщений со стабильным префиксом для кэширования промпта у провайдера.
+
+    Порядок: статический системный промпт, затем редко меняющийся профиль,
+    затем реплики диалога и новое сообщение пользователя.
+    """
+
+    def __init__(self, system_prompt: str, history_limit: int = 30):
+        self.history_limit = history_limit
+        # Один и тот же объект сообщения переиспользуется во всех запросах
+        self._system_message = {"role": "system", "content": system_prompt}
+
+    def build(self, user_message: str, conversation_context: List[Dict] = None,
+              client_profile: Dict = None) -> List[Dict]:
+        """Собрать список сообщений для запроса к модели"""
+        messages = [self._system_message]
+
+        profile_context = format_profile_context(client_profile)
+        if profile_context:
+            messages.append({"role": "system", "content": profile_context})
+
+        if conversation_context:
+            messages.extend(conversation_context[-self.history_limit:])
+
+        messages.append({"role": "user", "content": user_message})
+        return messages